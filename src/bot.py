@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from dataclasses import dataclass
+import sys
+from contextlib import aclosing
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from typing import Any, Coroutine, TypeVar
 
+import orjson
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.constants import ChatAction
+from telegram import Message, Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     ApplicationBuilder,
@@ -19,8 +22,10 @@ from telegram.ext import (
 )
 
 from config import ConfigError, Settings, load_settings
-from db import Database
-from llm_client import LLMError, PolzaLLMClient
+from db import MAX_ROWID, ChatMessage, Database, check_vector_search, utc_now_iso
+from embeddings import Embedder, EmbeddingError
+from llm_client import CACHE_CONTROL, MAX_REPLY_TOKENS, LLMError, LLMStream, PolzaLLMClient
+from response_cache import ResponseCache
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,12 +33,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+EMBEDDING_BACKFILL_BATCH = 32
+# Streamed replies are edited in place at most every ~30 chunks (about a token each)
+# or 400 ms, whichever comes first.
+STREAM_EDIT_CHUNKS = 30
+STREAM_EDIT_INTERVAL_SECONDS = 0.4
+# One summarize call folds at most this many messages; the rest goes on later turns.
+SUMMARY_BATCH_MESSAGES = 200
+SUMMARY_RETRY_SECONDS = 600
+
+SUMMARY_PROMPT = (
+    "Ты сжимаешь историю переписки для долговременной памяти собеседника. "
+    "Объедини предыдущее краткое содержание и новые реплики в одно связное резюме "
+    "от третьего лица: факты о пользователе, договорённости, важные события и тон общения. "
+    "Пиши кратко, без вступлений."
+)
+
+PROACTIVE_NUDGE_TEXT = (
+    "Был длительный перерыв в переписке. "
+    "Напиши короткое тёплое сообщение первой (1-2 предложения, без навязчивости), "
+    "чтобы мягко начать диалог снова."
+)
+# Shared across job runs and sent as-is: never mutate these dicts.
+PROACTIVE_NUDGE_MESSAGE: dict[str, Any] = {
+    "role": "user",
+    "content": [{"type": "text", "text": PROACTIVE_NUDGE_TEXT, "cache_control": CACHE_CONTROL}],
+}
+PROACTIVE_NUDGE_PLAIN_MESSAGE: dict[str, Any] = {"role": "user", "content": PROACTIVE_NUDGE_TEXT}
+
 
 @dataclass
 class Services:
     settings: Settings
     db: Database
     llm: PolzaLLMClient
+    embedder: Embedder | None = None
+    inflight: dict[int, asyncio.Task[Any]] = field(default_factory=dict)
+    summarizing: set[int] = field(default_factory=set)
+    # session_id -> loop time before which a failed summary is not retried
+    summary_retry_at: dict[int, float] = field(default_factory=dict)
+    background_tasks: set[asyncio.Task[Any]] = field(default_factory=set)
 
 
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -41,7 +82,7 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await _ensure_owner(update, services.settings):
         return
 
-    services.db.get_or_create_active_session(services.settings.owner_telegram_id)
+    await services.db.get_or_create_active_session(services.settings.owner_telegram_id)
     await update.effective_message.reply_text(
         "Привет. Это приватный companion-бот.\n"
         "Команды: /help, /reset, /export [N], /health"
@@ -68,7 +109,8 @@ async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await _ensure_owner(update, services.settings):
         return
 
-    session_id = services.db.create_new_session(services.settings.owner_telegram_id)
+    _cancel_inflight(services, update.effective_message.chat_id)
+    session_id = await services.db.create_new_session(services.settings.owner_telegram_id)
     await update.effective_message.reply_text(
         f"Контекст сброшен. Создана новая сессия: {session_id}."
     )
@@ -88,8 +130,8 @@ async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             return
     limit = max(1, min(requested, 200))
 
-    session_id = services.db.get_or_create_active_session(services.settings.owner_telegram_id)
-    rows = services.db.export_recent_messages(session_id, limit)
+    session_id = await services.db.get_or_create_active_session(services.settings.owner_telegram_id)
+    rows = await services.db.export_recent_messages(session_id, limit)
     if not rows:
         await update.effective_message.reply_text("История пустая")
         return
@@ -107,8 +149,10 @@ async def health_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if not await _ensure_owner(update, services.settings):
         return
 
-    status = services.db.health(services.settings.owner_telegram_id)
-    await update.effective_message.reply_text(json.dumps(status, ensure_ascii=False, indent=2))
+    status = await services.db.health(services.settings.owner_telegram_id)
+    await update.effective_message.reply_text(
+        orjson.dumps(status, option=orjson.OPT_INDENT_2).decode()
+    )
 
 
 async def text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -121,40 +165,49 @@ async def text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not user_text:
         return
 
-    session_id = services.db.get_or_create_active_session(services.settings.owner_telegram_id)
-    services.db.add_message(session_id=session_id, role="user", content=user_text)
-
-    history = services.db.get_context_messages(
+    session_id = await services.db.get_or_create_active_session(services.settings.owner_telegram_id)
+    now = utc_now_iso()
+    user_message_id = await services.db.add_message(
         session_id=session_id,
-        limit=services.settings.max_context_messages,
+        role="user",
+        content=user_text,
+        now=now,
     )
-    messages: list[dict[str, str]] = [{"role": "system", "content": services.settings.system_prompt}]
-    messages.extend({"role": m.role, "content": m.content} for m in history)
+    query_vector = await _index_message(services, session_id, user_message_id, user_text)
 
-    typing_task: asyncio.Task[None] | None = None
-    if message.chat_id:
-        typing_task = asyncio.create_task(_typing_loop(context, message.chat_id))
+    messages, prompt_tokens = await _build_context(services, session_id, query_vector)
 
+    placeholder = await message.reply_text("…")
+    stream = services.llm.generate_stream(
+        messages,
+        prefix_id=services.llm.prefix_id(session_id, services.settings.system_prompt),
+        prompt_tokens=prompt_tokens,
+    )
+    llm_task = _start_inflight(services, message.chat_id, _stream_reply(stream, placeholder))
     try:
-        assistant_text, meta = await services.llm.generate(messages)
+        await llm_task
     except LLMError:
-        await message.reply_text("Сервис временно недоступен, попробуй ещё раз.")
+        await _edit_reply(placeholder, "Сервис временно недоступен, попробуй ещё раз.")
+        return
+    except asyncio.CancelledError:
+        if not _superseded(llm_task):
+            raise
+        logger.info("Reply in chat %s superseded by newer input", message.chat_id)
+        await _delete_reply(placeholder)
         return
     finally:
-        if typing_task:
-            typing_task.cancel()
-            try:
-                await typing_task
-            except asyncio.CancelledError:
-                pass
-
-    services.db.add_message(
+        if not llm_task.done():
+            llm_task.cancel()
+
+    assistant_message_id = await services.db.add_message(
         session_id=session_id,
         role="assistant",
-        content=assistant_text,
-        meta=meta,
+        content=stream.text,
+        meta=stream.meta,
+        now=now,
     )
-    await message.reply_text(assistant_text)
+    _schedule_indexing(services, session_id, assistant_message_id, stream.text)
+    await _edit_reply(placeholder, stream.text)
 
 
 async def proactive_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -162,12 +215,16 @@ async def proactive_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     if not services.settings.auto_message_enabled:
         return
 
-    session_id = services.db.get_or_create_active_session(services.settings.owner_telegram_id)
-    last_user = services.db.get_last_user_message(session_id)
+    session_id = await services.db.get_or_create_active_session(services.settings.owner_telegram_id)
+    # Independent reads, so neither waits on the other's round trip.
+    last_user, last_proactive_id = await asyncio.gather(
+        services.db.get_last_user_message(session_id),
+        services.db.get_last_proactive_id(session_id),
+    )
     if not last_user:
         return
 
-    if services.db.has_proactive_after(session_id, last_user.id):
+    if last_proactive_id is not None and last_proactive_id > last_user.id:
         return
 
     now = datetime.now(tz=timezone.utc)
@@ -181,30 +238,35 @@ async def proactive_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     if idle_seconds < required_idle_seconds:
         return
 
-    history = services.db.get_context_messages(
-        session_id=session_id,
-        limit=services.settings.max_context_messages,
+    query_vector = await _embed(services, last_user.content)
+    prompt_messages, prompt_tokens = await _build_context(services, session_id, query_vector)
+    nudge = (
+        PROACTIVE_NUDGE_MESSAGE
+        if services.settings.llm_prompt_cache_enabled
+        else PROACTIVE_NUDGE_PLAIN_MESSAGE
     )
-    prompt_messages: list[dict[str, str]] = [
-        {"role": "system", "content": services.settings.system_prompt},
-    ]
-    prompt_messages.extend({"role": m.role, "content": m.content} for m in history)
-    prompt_messages.append(
-        {
-            "role": "user",
-            "content": (
-                "Был длительный перерыв в переписке. "
-                "Напиши короткое тёплое сообщение первой (1-2 предложения, без навязчивости), "
-                "чтобы мягко начать диалог снова."
-            ),
-        }
+    prompt_messages.append(nudge)
+    prompt_tokens += services.llm.count_message_tokens(nudge)
+
+    llm_task = _start_inflight(
+        services,
+        services.settings.owner_telegram_id,
+        services.llm.generate(
+            prompt_messages,
+            prefix_id=services.llm.prefix_id(session_id, services.settings.system_prompt),
+            prompt_tokens=prompt_tokens,
+        ),
     )
-
     try:
-        assistant_text, meta = await services.llm.generate(prompt_messages)
+        assistant_text, meta = await llm_task
     except LLMError:
         logger.exception("Failed to generate proactive message")
         return
+    except asyncio.CancelledError:
+        if not _superseded(llm_task):
+            raise
+        logger.info("Proactive message dropped: owner wrote first")
+        return
 
     meta = {
         **meta,
@@ -213,13 +275,15 @@ async def proactive_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         "idle_seconds": int(idle_seconds),
         "required_idle_seconds": int(required_idle_seconds),
     }
-    services.db.add_message(
+    assistant_message_id = await services.db.add_message(
         session_id=session_id,
         role="assistant",
         content=assistant_text,
         meta=meta,
         is_proactive=True,
+        now=now.isoformat(),
     )
+    _schedule_indexing(services, session_id, assistant_message_id, assistant_text)
 
     try:
         await context.bot.send_message(
@@ -230,6 +294,211 @@ async def proactive_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.exception("Unable to send proactive message to owner")
 
 
+async def _build_context(
+    services: Services,
+    session_id: int,
+    query_vector: list[float] | None = None,
+) -> tuple[list[dict[str, Any]], int]:
+    """Assemble the prompt within CONTEXT_TOKEN_BUDGET; returns it with its token count.
+
+    System blocks go first; history is taken newest to oldest until the budget or
+    MAX_CONTEXT_MESSAGES is hit, so the latest message is always included and last.
+    """
+    llm = services.llm
+    budget = services.settings.context_token_budget - MAX_REPLY_TOKENS
+    summary = await services.db.get_latest_summary(session_id)
+
+    head: list[dict[str, Any]] = [llm.system_message(services.settings.system_prompt)]
+    if summary:
+        head.append(
+            {
+                "role": "system",
+                "content": f"Краткое содержание более ранней части разговора:\n{summary.content}",
+            }
+        )
+    used = sum(llm.count_message_tokens(m) for m in head)
+
+    window: list[dict[str, Any]] = []
+    window_ids: list[int] = []
+    window_tokens: list[int] = []
+    async with aclosing(services.db.iter_messages_desc(session_id)) as history:
+        async for m in history:
+            item = {"role": m.role, "content": m.content}
+            tokens = llm.count_message_tokens(item)
+            if window and (
+                used + tokens > budget or len(window) >= services.settings.max_context_messages
+            ):
+                break
+            window.append(item)
+            window_ids.append(m.id)
+            window_tokens.append(tokens)
+            used += tokens
+    window.reverse()
+    window_ids.reverse()
+    window_tokens.reverse()
+
+    if query_vector and window:
+        recalled = await services.db.search_similar_messages(
+            session_id,
+            query_vector,
+            before_id=window_ids[0],
+            limit=services.settings.retrieval_top_k,
+        )
+        if recalled:
+            block = {
+                "role": "system",
+                "content": "Фрагменты более ранней переписки, которые могут быть важны сейчас:\n"
+                + _format_transcript(recalled),
+            }
+            head.append(block)
+            used += llm.count_message_tokens(block)
+            while len(window) > 1 and used > budget:
+                window.pop(0)
+                window_ids.pop(0)
+                used -= window_tokens.pop(0)
+
+    if window:
+        await _maybe_schedule_summary(
+            services,
+            session_id=session_id,
+            after_id=summary.upto_message_id if summary else 0,
+            before_id=window_ids[0],
+        )
+    return head + window, used
+
+
+async def _maybe_schedule_summary(
+    services: Services,
+    session_id: int,
+    after_id: int,
+    before_id: int,
+) -> None:
+    if session_id in services.summarizing:
+        return
+    retry_at = services.summary_retry_at.get(session_id)
+    if retry_at is not None and asyncio.get_running_loop().time() < retry_at:
+        return
+    pending = await services.db.count_messages_between(session_id, after_id, before_id)
+    if pending <= services.settings.summarize_threshold:
+        return
+
+    services.summarizing.add(session_id)
+    task = asyncio.create_task(_summarize(services, session_id, after_id, before_id))
+    services.background_tasks.add(task)
+    task.add_done_callback(services.background_tasks.discard)
+
+
+async def _summarize(services: Services, session_id: int, after_id: int, before_id: int) -> None:
+    llm = services.llm
+    try:
+        previous = await services.db.get_latest_summary(session_id)
+        candidates = await services.db.get_messages_between(
+            session_id,
+            after_id,
+            before_id,
+            limit=SUMMARY_BATCH_MESSAGES,
+        )
+        if not candidates:
+            return
+
+        parts: list[str] = []
+        if previous:
+            parts.append(f"Предыдущее краткое содержание:\n{previous.content}")
+        system = {"role": "system", "content": SUMMARY_PROMPT}
+        budget = (
+            services.settings.context_token_budget
+            - MAX_REPLY_TOKENS
+            - llm.count_message_tokens(system)
+            - llm.count_message_tokens({"role": "user", "content": "\n\n".join(parts)})
+        )
+        # Fold the oldest messages that fit; the remainder is picked up on later turns.
+        older: list[ChatMessage] = []
+        for m in candidates:
+            budget -= llm.count_tokens(_format_transcript([m])) + 1
+            if older and budget < 0:
+                break
+            older.append(m)
+
+        parts.append("Новые реплики:\n" + _format_transcript(older))
+        prompt = [system, {"role": "user", "content": "\n\n".join(parts)}]
+
+        content, _ = await llm.generate(prompt)
+        await services.db.add_summary(session_id, upto_message_id=older[-1].id, content=content)
+        services.summary_retry_at.pop(session_id, None)
+        logger.info("Session %s summarized up to message %s", session_id, older[-1].id)
+    except LLMError:
+        logger.warning(
+            "Failed to summarize session %s, retrying in %ss",
+            session_id,
+            SUMMARY_RETRY_SECONDS,
+        )
+        services.summary_retry_at[session_id] = (
+            asyncio.get_running_loop().time() + SUMMARY_RETRY_SECONDS
+        )
+    finally:
+        services.summarizing.discard(session_id)
+
+
+async def _embed(services: Services, text: str) -> list[float] | None:
+    if not services.embedder:
+        return None
+    try:
+        return await services.embedder.embed(text)
+    except Exception:  # noqa: BLE001
+        logger.warning("Failed to embed message", exc_info=True)
+        return None
+
+
+async def _index_message(
+    services: Services,
+    session_id: int,
+    message_id: int,
+    text: str,
+) -> list[float] | None:
+    vector = await _embed(services, text)
+    if vector:
+        await services.db.add_message_embedding(message_id, session_id, vector)
+    return vector
+
+
+async def _backfill_embeddings(services: Services) -> None:
+    """Index turns stored before retrieval was enabled, newest first."""
+    assert services.embedder is not None
+    total = 0
+    before_id = MAX_ROWID
+    while pending := await services.db.get_unindexed_messages(
+        EMBEDDING_BACKFILL_BATCH,
+        before_id=before_id,
+    ):
+        try:
+            vectors = await services.embedder.embed_many([content for _, _, content in pending])
+        except Exception:  # noqa: BLE001
+            logger.warning("Embedding backfill stopped", exc_info=True)
+            return
+        await services.db.add_message_embeddings(
+            [
+                (message_id, session_id, vector)
+                for (message_id, session_id, _), vector in zip(pending, vectors)
+            ]
+        )
+        total += len(pending)
+        before_id = pending[-1][0]
+    if total:
+        logger.info("Embedding backfill indexed %s messages", total)
+
+
+def _schedule_indexing(services: Services, session_id: int, message_id: int, text: str) -> None:
+    if not services.embedder:
+        return
+    task = asyncio.create_task(_index_message(services, session_id, message_id, text))
+    services.background_tasks.add(task)
+    task.add_done_callback(services.background_tasks.discard)
+
+
+def _format_transcript(messages: list[ChatMessage]) -> str:
+    return "\n".join(f"{m.role}: {m.content}" for m in messages)
+
+
 async def _ensure_owner(update: Update, settings: Settings) -> bool:
     user = update.effective_user
     message = update.effective_message
@@ -246,22 +515,93 @@ async def _ensure_owner(update: Update, settings: Settings) -> bool:
 
 
 def _deterministic_idle_seconds(message_id: int, min_hours: float, max_hours: float) -> float:
-    if min_hours == max_hours:
-        return min_hours * 3600
-    span = max_hours - min_hours
-    hashed = (message_id * 2654435761) % 1000
-    ratio = hashed / 999.0
-    return (min_hours + span * ratio) * 3600
+    # Knuth multiplicative hash; the top 10 bits of the 32-bit product are uniform.
+    hashed = ((message_id * 2654435761) & 0xFFFFFFFF) >> 22
+    ratio = hashed / 1024.0
+    return (min_hours + (max_hours - min_hours) * ratio) * 3600.0
+
+
+def _start_inflight(
+    services: Services,
+    chat_id: int,
+    coro: Coroutine[Any, Any, T],
+) -> asyncio.Task[T]:
+    """Run an LLM call as the chat's only in-flight request, cancelling the previous one."""
+    _cancel_inflight(services, chat_id)
+    task = asyncio.create_task(coro)
+    services.inflight[chat_id] = task
+
+    def _forget(done: asyncio.Task[T]) -> None:
+        if services.inflight.get(chat_id) is done:
+            del services.inflight[chat_id]
+
+    task.add_done_callback(_forget)
+    return task
+
+
+def _cancel_inflight(services: Services, chat_id: int) -> None:
+    previous = services.inflight.pop(chat_id, None)
+    if previous and not previous.done():
+        previous.cancel()
+
+
+def _superseded(task: asyncio.Task[Any]) -> bool:
+    """True when the LLM task was cancelled by newer input rather than by shutdown."""
+    current = asyncio.current_task()
+    return task.cancelled() and not (current and current.cancelling())
+
+
+async def _stream_reply(stream: LLMStream, placeholder: Message) -> None:
+    """Mirror the growing reply into the placeholder, debounced to spare Telegram's edit limits.
+
+    Intermediate edits are cosmetic: failures are skipped so the reply itself is never
+    lost, and flood control pauses editing until Telegram allows it again.
+    """
+    loop = asyncio.get_running_loop()
+    shown = buffer = ""
+    pending_chunks = 0
+    last_edit = loop.time()
+    paused_until = 0.0
+    async with aclosing(stream):
+        async for delta in stream:
+            buffer += delta
+            pending_chunks += 1
+            now = loop.time()
+            if now < paused_until or (
+                pending_chunks < STREAM_EDIT_CHUNKS
+                and now - last_edit < STREAM_EDIT_INTERVAL_SECONDS
+            ):
+                continue
+            text = buffer.strip()
+            if text and text != shown:
+                try:
+                    await placeholder.edit_text(text)
+                    shown = text
+                except RetryAfter as exc:
+                    paused_until = loop.time() + exc.retry_after
+                except TelegramError:
+                    logger.debug("Skipping intermediate reply edit", exc_info=True)
+            pending_chunks = 0
+            last_edit = loop.time()
+
+
+async def _edit_reply(placeholder: Message, text: str) -> None:
+    """Final edit of the placeholder; waits out flood control rather than drop it."""
+    try:
+        await placeholder.edit_text(text)
+    except RetryAfter as exc:
+        await asyncio.sleep(exc.retry_after)
+        await placeholder.edit_text(text)
+    except BadRequest as exc:
+        if "not modified" not in str(exc).lower():
+            raise
 
 
-async def _typing_loop(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
-    while True:
-        try:
-            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-        except Exception:  # noqa: BLE001
-            logger.debug("Unable to send typing action", exc_info=True)
-        await asyncio.sleep(4)
-
+async def _delete_reply(placeholder: Message) -> None:
+    try:
+        await placeholder.delete()
+    except Exception:  # noqa: BLE001
+        logger.debug("Unable to delete superseded reply", exc_info=True)
 
 
 def _services(context: ContextTypes.DEFAULT_TYPE) -> Services:
@@ -269,8 +609,38 @@ def _services(context: ContextTypes.DEFAULT_TYPE) -> Services:
 
 
 
+async def _on_startup(app: Application) -> None:
+    services: Services = app.bot_data["services"]
+    await services.db.init()
+    if services.embedder:
+        try:
+            await services.db.enable_vector_search()
+        except EmbeddingError:
+            # PTB swallows SystemExit from post_init, so fail with a visible error.
+            logger.exception("Retrieval setup error")
+            raise
+        task = asyncio.create_task(_backfill_embeddings(services))
+        services.background_tasks.add(task)
+        task.add_done_callback(services.background_tasks.discard)
+
+
+async def _on_shutdown(app: Application) -> None:
+    services: Services = app.bot_data["services"]
+    if services.background_tasks:
+        await asyncio.gather(*services.background_tasks, return_exceptions=True)
+    await services.llm.aclose()
+    await services.db.close()
+
+
 def build_application(services: Services) -> Application:
-    app = ApplicationBuilder().token(services.settings.telegram_bot_token).build()
+    app = (
+        ApplicationBuilder()
+        .token(services.settings.telegram_bot_token)
+        .concurrent_updates(True)
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
     app.bot_data["services"] = services
 
     app.add_handler(CommandHandler("start", start_cmd))
@@ -298,6 +668,18 @@ def build_application(services: Services) -> Application:
 
 
 
+def _install_uvloop() -> None:
+    """Run the bot on uvloop where available; run_polling uses the current event loop."""
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop is not installed, using the default asyncio event loop")
+        return
+    asyncio.set_event_loop(uvloop.new_event_loop())
+
+
 def main() -> None:
     load_dotenv()
     try:
@@ -306,18 +688,38 @@ def main() -> None:
         raise SystemExit(f"Config error: {exc}") from exc
 
     db = Database(settings.sqlite_path)
-    db.init()
+
+    embedder: Embedder | None = None
+    if settings.retrieval_enabled:
+        try:
+            embedder = Embedder(settings.embedding_model)
+            check_vector_search()
+        except EmbeddingError as exc:
+            raise SystemExit(f"Retrieval setup error: {exc}") from exc
+
+    response_cache: ResponseCache | None = None
+    if settings.response_cache_enabled:
+        response_cache = ResponseCache(
+            db,
+            embedder=embedder,
+            similarity_threshold=settings.response_cache_similarity,
+            ttl_seconds=settings.response_cache_ttl_hours * 3600,
+        )
 
     llm = PolzaLLMClient(
         api_key=settings.polza_api_key,
         base_url=settings.polza_base_url,
         model=settings.polza_model,
         timeout_seconds=settings.llm_timeout_seconds,
+        prompt_cache_enabled=settings.llm_prompt_cache_enabled,
+        response_cache=response_cache,
+        context_token_budget=settings.context_token_budget,
     )
 
-    services = Services(settings=settings, db=db, llm=llm)
+    services = Services(settings=settings, db=db, llm=llm, embedder=embedder)
     app = build_application(services)
 
+    _install_uvloop()
     logger.info("Bot started with long polling")
     app.run_polling(close_loop=False)
 
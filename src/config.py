@@ -3,6 +3,8 @@ from __future__ import annotations
 import os
 from dataclasses import dataclass
 
+from embeddings import DEFAULT_EMBEDDING_MODEL
+
 
 class ConfigError(ValueError):
     """Raised when configuration is invalid."""
@@ -18,6 +20,8 @@ class Settings:
     system_prompt: str
     database_url: str
     max_context_messages: int
+    context_token_budget: int
+    summarize_threshold: int
     llm_timeout_seconds: float
     unauthorized_mode: str
     unauthorized_message: str
@@ -25,6 +29,13 @@ class Settings:
     auto_message_idle_hours_min: float
     auto_message_idle_hours_max: float
     auto_message_check_minutes: int
+    llm_prompt_cache_enabled: bool
+    retrieval_enabled: bool
+    retrieval_top_k: int
+    embedding_model: str
+    response_cache_enabled: bool
+    response_cache_similarity: float
+    response_cache_ttl_hours: float
 
     @property
     def sqlite_path(self) -> str:
@@ -76,18 +87,58 @@ def load_settings() -> Settings:
     except ValueError as exc:
         raise ConfigError("MAX_CONTEXT_MESSAGES must be integer") from exc
 
+    budget_raw = os.getenv("CONTEXT_TOKEN_BUDGET", "6000").strip()
+    try:
+        context_token_budget = int(budget_raw)
+    except ValueError as exc:
+        raise ConfigError("CONTEXT_TOKEN_BUDGET must be integer") from exc
+    if context_token_budget < 1000:
+        raise ConfigError("CONTEXT_TOKEN_BUDGET must be >= 1000")
+
+    summarize_raw = os.getenv("SUMMARIZE_THRESHOLD", "20").strip()
+    try:
+        summarize_threshold = int(summarize_raw)
+    except ValueError as exc:
+        raise ConfigError("SUMMARIZE_THRESHOLD must be integer") from exc
+    if summarize_threshold < 1:
+        raise ConfigError("SUMMARIZE_THRESHOLD must be >= 1")
+
     timeout_raw = os.getenv("LLM_TIMEOUT_SECONDS", "60").strip()
     try:
         llm_timeout_seconds = float(timeout_raw)
     except ValueError as exc:
         raise ConfigError("LLM_TIMEOUT_SECONDS must be number") from exc
 
+    similarity_raw = os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97").strip()
+    try:
+        response_cache_similarity = float(similarity_raw)
+    except ValueError as exc:
+        raise ConfigError("RESPONSE_CACHE_SIMILARITY must be number") from exc
+    if not 0 < response_cache_similarity <= 1:
+        raise ConfigError("RESPONSE_CACHE_SIMILARITY must be in (0, 1]")
+
+    cache_ttl_raw = os.getenv("RESPONSE_CACHE_TTL_HOURS", "24").strip()
+    try:
+        response_cache_ttl_hours = float(cache_ttl_raw)
+    except ValueError as exc:
+        raise ConfigError("RESPONSE_CACHE_TTL_HOURS must be number") from exc
+    if response_cache_ttl_hours <= 0:
+        raise ConfigError("RESPONSE_CACHE_TTL_HOURS must be > 0")
+
     unauthorized_mode = os.getenv("UNAUTHORIZED_MODE", "deny").strip().lower()
     if unauthorized_mode not in {"deny", "ignore"}:
         raise ConfigError("UNAUTHORIZED_MODE must be 'deny' or 'ignore'")
 
     auto_message_enabled = _get_bool("AUTO_MESSAGE_ENABLED", False)
 
+    top_k_raw = os.getenv("RETRIEVAL_TOP_K", "4").strip()
+    try:
+        retrieval_top_k = int(top_k_raw)
+    except ValueError as exc:
+        raise ConfigError("RETRIEVAL_TOP_K must be integer") from exc
+    if retrieval_top_k < 1:
+        raise ConfigError("RETRIEVAL_TOP_K must be >= 1")
+
     min_idle_raw = os.getenv("AUTO_MESSAGE_IDLE_HOURS_MIN", "1").strip()
     max_idle_raw = os.getenv("AUTO_MESSAGE_IDLE_HOURS_MAX", "3").strip()
     try:
@@ -114,9 +165,11 @@ def load_settings() -> Settings:
         polza_api_key=_get_required("POLZA_API_KEY"),
         polza_base_url=os.getenv("POLZA_BASE_URL", "https://api.polza.ai/api/v1").strip(),
         polza_model=_get_required("POLZA_MODEL"),
-        system_prompt=SYSTEM_PROMPT,
+        system_prompt=SYSTEM_PROMPT.strip(),
         database_url=os.getenv("DATABASE_URL", "sqlite:///data.db").strip(),
         max_context_messages=max_context_messages,
+        context_token_budget=context_token_budget,
+        summarize_threshold=summarize_threshold,
         llm_timeout_seconds=llm_timeout_seconds,
         unauthorized_mode=unauthorized_mode,
         unauthorized_message=os.getenv("UNAUTHORIZED_MESSAGE", "Access denied").strip(),
@@ -124,4 +177,11 @@ def load_settings() -> Settings:
         auto_message_idle_hours_min=auto_message_idle_hours_min,
         auto_message_idle_hours_max=auto_message_idle_hours_max,
         auto_message_check_minutes=auto_message_check_minutes,
+        llm_prompt_cache_enabled=_get_bool("LLM_PROMPT_CACHE_ENABLED", True),
+        retrieval_enabled=_get_bool("RETRIEVAL_ENABLED", False),
+        retrieval_top_k=retrieval_top_k,
+        embedding_model=os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL).strip(),
+        response_cache_enabled=_get_bool("RESPONSE_CACHE_ENABLED", False),
+        response_cache_similarity=response_cache_similarity,
+        response_cache_ttl_hours=response_cache_ttl_hours,
     )
@@ -1,19 +1,227 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import logging
 import sqlite3
+import struct
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator
+
+import aiosqlite
+import orjson
+
+from embeddings import EmbeddingError
+
+logger = logging.getLogger(__name__)
+
+Params = tuple[Any, ...]
+# A list of parameter tuples is run with executemany.
+Statement = tuple[str, Params | list[Params]]
+
+FLUSH_INTERVAL_SECONDS = 0.1
+ITER_PAGE_SIZE = 32
+MAX_ROWID = 2**63 - 1
+
+# messages.role is stored as a small integer; decoding indexes a tuple of interned
+# literals, so every row shares the same three str objects.
+ROLE_TO_INT = {"user": 0, "assistant": 1, "system": 2}
+INT_TO_ROLE = ("user", "assistant", "system")
+
+SQL_CREATE_MESSAGES = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL,
+    role INTEGER NOT NULL CHECK (role IN (0, 1, 2)),
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    meta_json TEXT,
+    is_proactive INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (session_id) REFERENCES sessions(id)
+)
+"""
+
+SQL_COPY_LEGACY_MESSAGES = """
+INSERT INTO messages_new (id, session_id, role, content, created_at, meta_json, is_proactive)
+SELECT
+    id,
+    session_id,
+    CASE role WHEN 'user' THEN 0 WHEN 'assistant' THEN 1 WHEN 'system' THEN 2 END,
+    content,
+    created_at,
+    meta_json,
+    is_proactive
+FROM messages
+"""
+
+# Read-only view with textual roles for ad-hoc queries and external tooling.
+SQL_CREATE_MESSAGES_VIEW = """
+CREATE VIEW IF NOT EXISTS messages_with_role_names AS
+SELECT
+    id,
+    session_id,
+    CASE role WHEN 0 THEN 'user' WHEN 1 THEN 'assistant' WHEN 2 THEN 'system' END AS role,
+    content,
+    created_at,
+    meta_json,
+    is_proactive
+FROM messages
+"""
+
+SQL_GET_ACTIVE_SESSION = """
+SELECT id, created_at
+FROM sessions
+WHERE owner_telegram_id = ? AND is_active = 1
+"""
+
+SQL_DEACTIVATE_SESSIONS = (
+    "UPDATE sessions SET is_active = 0 WHERE owner_telegram_id = ? AND is_active = 1"
+)
+
+SQL_INSERT_SESSION = """
+INSERT INTO sessions (owner_telegram_id, created_at, is_active)
+VALUES (?, ?, 1)
+"""
+# RETURNING needs SQLite 3.35+; older builds fall back to cursor.lastrowid.
+if sqlite3.sqlite_version_info >= (3, 35, 0):
+    SQL_INSERT_SESSION += "RETURNING id\n"
+
+# Concurrent first messages may both try to open a session; the loser is a no-op.
+SQL_INSERT_SESSION_IF_NONE_ACTIVE = """
+INSERT INTO sessions (owner_telegram_id, created_at, is_active)
+VALUES (?, ?, 1)
+ON CONFLICT (owner_telegram_id) WHERE is_active = 1 DO NOTHING
+"""
+
+SQL_DEACTIVATE_DUPLICATE_SESSIONS = """
+UPDATE sessions
+SET is_active = 0
+WHERE is_active = 1
+  AND id NOT IN (
+      SELECT MAX(id) FROM sessions WHERE is_active = 1 GROUP BY owner_telegram_id
+  )
+"""
+
+SQL_INSERT_MESSAGE = """
+INSERT INTO messages (session_id, role, content, created_at, meta_json, is_proactive)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_ITER_MESSAGES_DESC = """
+SELECT id, role, content
+FROM messages
+WHERE session_id = ? AND role IN (0, 1)
+ORDER BY id DESC
+"""
+
+SQL_GET_MESSAGES_BETWEEN = """
+SELECT id, role, content
+FROM messages
+WHERE session_id = ? AND role IN (0, 1) AND id > ? AND id < ?
+ORDER BY id
+LIMIT ?
+"""
+
+SQL_COUNT_MESSAGES_BETWEEN = """
+SELECT COUNT(*) AS c
+FROM messages
+WHERE session_id = ? AND role IN (0, 1) AND id > ? AND id < ?
+"""
+
+SQL_GET_LAST_USER_MESSAGE = """
+SELECT id, content, created_at
+FROM messages
+WHERE session_id = ? AND role = 0
+ORDER BY id DESC
+LIMIT 1
+"""
+
+SQL_GET_LAST_PROACTIVE_ID = """
+SELECT MAX(id) AS id
+FROM messages
+WHERE session_id = ? AND is_proactive = 1
+"""
+
+SQL_EXPORT_RECENT = """
+SELECT role, content, created_at
+FROM messages
+WHERE session_id = ?
+ORDER BY id DESC
+LIMIT ?
+"""
+
+SQL_COUNT_MESSAGES = "SELECT COUNT(*) AS c FROM messages"
+
+SQL_GET_LATEST_SUMMARY = """
+SELECT upto_message_id, content
+FROM summaries
+WHERE session_id = ?
+ORDER BY id DESC
+LIMIT 1
+"""
+
+SQL_INSERT_SUMMARY = """
+INSERT INTO summaries (session_id, upto_message_id, content, created_at)
+VALUES (?, ?, ?, ?)
+"""
+
+SQL_UPSERT_EMBEDDING = """
+INSERT OR REPLACE INTO message_embeddings (message_id, session_id, vec)
+VALUES (?, ?, ?)
+"""
+
+SQL_SEARCH_SIMILAR = """
+SELECT m.id, m.role, m.content
+FROM message_embeddings e
+JOIN messages m ON m.id = e.message_id
+WHERE e.session_id = ? AND e.message_id < ?
+ORDER BY vec_distance_cosine(e.vec, ?)
+LIMIT ?
+"""
+
+# Keyset pagination: each page continues below the smallest id of the previous one,
+# so already indexed rows are walked past once instead of on every page.
+SQL_GET_UNINDEXED_MESSAGES = """
+SELECT m.id, m.session_id, m.content
+FROM messages m
+LEFT JOIN message_embeddings e ON e.message_id = m.id
+WHERE m.id < ? AND e.message_id IS NULL AND m.role IN (0, 1)
+ORDER BY m.id DESC
+LIMIT ?
+"""
+
+SQL_GET_CACHED_RESPONSE = """
+SELECT payload, created_at
+FROM response_cache
+WHERE key = ? AND created_at >= ?
+"""
+
+SQL_PUT_CACHED_RESPONSE = """
+INSERT OR REPLACE INTO response_cache (key, payload, created_at)
+VALUES (?, ?, ?)
+"""
+
+SQL_PRUNE_RESPONSE_CACHE = """
+DELETE FROM response_cache
+WHERE created_at < ?
+   OR key NOT IN (SELECT key FROM response_cache ORDER BY created_at DESC LIMIT ?)
+"""
 
 
 @dataclass(frozen=True)
 class ChatMessage:
+    id: int
     role: str
     content: str
 
 
+@dataclass(frozen=True)
+class Summary:
+    upto_message_id: int
+    content: str
+
+
 @dataclass(frozen=True)
 class LastUserMessage:
     id: int
@@ -21,20 +229,47 @@ class LastUserMessage:
     created_at: datetime
 
 
+@dataclass
+class _WriteOp:
+    statements: list[Statement]
+    future: asyncio.Future[int]
+
+
 class Database:
+    """SQLite storage on aiosqlite.
+
+    Reads are awaited directly. Writes go through a queue drained by a single writer
+    task that executes them right away and commits once the queue is drained, or
+    after FLUSH_INTERVAL_SECONDS under sustained load, so a burst of inserts shares
+    one transaction. A write resolves only after its batch is committed.
+    """
+
     def __init__(self, sqlite_path: str) -> None:
         self._sqlite_path = sqlite_path
         db_path = Path(sqlite_path)
         if db_path.parent and str(db_path.parent) != ".":
             db_path.parent.mkdir(parents=True, exist_ok=True)
-        self._conn = sqlite3.connect(sqlite_path)
-        self._conn.row_factory = sqlite3.Row
+        self._conn: aiosqlite.Connection | None = None
+        self._write_queue: asyncio.Queue[_WriteOp | None] = asyncio.Queue()
+        self._writer_task: asyncio.Task[None] | None = None
 
-    def close(self) -> None:
-        self._conn.close()
+    async def close(self) -> None:
+        if self._writer_task:
+            await self._write_queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+        if self._conn:
+            await self._conn.close()
+            self._conn = None
 
-    def init(self) -> None:
-        self._conn.execute(
+    async def init(self) -> None:
+        self._conn = await aiosqlite.connect(self._sqlite_path)
+        self._conn.row_factory = sqlite3.Row
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute("PRAGMA temp_store=MEMORY")
+
+        await self._conn.execute(
             """
             CREATE TABLE IF NOT EXISTS sessions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,105 +279,268 @@ class Database:
             )
             """
         )
-        self._conn.execute(
+        await self._conn.execute(SQL_CREATE_MESSAGES.format(table="messages"))
+        await self._conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS messages (
+            CREATE TABLE IF NOT EXISTS summaries (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 session_id INTEGER NOT NULL,
-                role TEXT NOT NULL,
+                upto_message_id INTEGER NOT NULL,
                 content TEXT NOT NULL,
                 created_at TEXT NOT NULL,
-                meta_json TEXT,
-                is_proactive INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (session_id) REFERENCES sessions(id)
             )
             """
         )
-        self._ensure_message_column("is_proactive", "INTEGER NOT NULL DEFAULT 0")
-        self._conn.commit()
+        await self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        await self._ensure_message_column("is_proactive", "INTEGER NOT NULL DEFAULT 0")
+        migrated = await self._migrate_text_roles()
+        await self._conn.execute(SQL_CREATE_MESSAGES_VIEW)
+        await self._ensure_indexes(analyze=migrated)
+        await self._conn.commit()
+
+        self._writer_task = asyncio.create_task(self._writer(), name="sqlite-writer")
+
+    async def enable_vector_search(self) -> None:
+        extension_path = check_vector_search()
+        conn = self._require_conn()
+        await conn.enable_load_extension(True)
+        try:
+            await conn.load_extension(extension_path)
+        finally:
+            await conn.enable_load_extension(False)
+
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS message_embeddings (
+                message_id INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL,
+                vec BLOB NOT NULL,
+                FOREIGN KEY (message_id) REFERENCES messages(id)
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_message_embeddings_session
+            ON message_embeddings(session_id, message_id)
+            """
+        )
+        await conn.commit()
+
+    async def _migrate_text_roles(self) -> bool:
+        """Rebuild a legacy messages table whose role column is TEXT.
+
+        SQLite cannot change a column type in place, so the table is copied into the
+        new schema and swapped. Indexes on the old table go with it and are recreated
+        by _ensure_indexes.
+        """
+        rows = await self._fetchall("PRAGMA table_info(messages)")
+        role_type = next((str(row["type"]) for row in rows if row["name"] == "role"), "")
+        if role_type.upper() != "TEXT":
+            return False
+
+        logger.info("Migrating messages.role from TEXT to INTEGER")
+        conn = self._require_conn()
+        await conn.execute("BEGIN")
+        try:
+            await conn.execute(SQL_CREATE_MESSAGES.format(table="messages_new"))
+            await conn.execute(SQL_COPY_LEGACY_MESSAGES)
+            await conn.execute("DROP TABLE messages")
+            await conn.execute("ALTER TABLE messages_new RENAME TO messages")
+        except Exception:
+            await conn.rollback()
+            raise
+        await conn.commit()
+        return True
+
+    async def _ensure_indexes(self, analyze: bool = False) -> None:
+        conn = self._require_conn()
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id)"
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_session_id_role
+            ON messages(session_id, role, id DESC)
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_session_proactive
+            ON messages(session_id, id)
+            WHERE is_proactive = 1
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_owner_active
+            ON sessions(owner_telegram_id, is_active, id DESC)
+            """
+        )
+        # Older databases could end up with several active sessions per owner; keep the
+        # newest one so the unique index below can be built.
+        await conn.execute(SQL_DEACTIVATE_DUPLICATE_SESSIONS)
+        await conn.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uniq_active_session
+            ON sessions(owner_telegram_id)
+            WHERE is_active = 1
+            """
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_summaries_session_id ON summaries(session_id, id)"
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_response_cache_created_at
+            ON response_cache(created_at)
+            """
+        )
+
+        stats = await self._fetchone(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        )
+        if analyze or not stats:
+            await conn.execute("ANALYZE")
 
-    def _ensure_message_column(self, name: str, ddl: str) -> None:
-        rows = self._conn.execute("PRAGMA table_info(messages)").fetchall()
+    async def _ensure_message_column(self, name: str, ddl: str) -> None:
+        rows = await self._fetchall("PRAGMA table_info(messages)")
         existing = {str(row["name"]) for row in rows}
         if name in existing:
             return
-        self._conn.execute(f"ALTER TABLE messages ADD COLUMN {name} {ddl}")
-
-    def get_or_create_active_session(self, owner_telegram_id: int) -> int:
-        row = self._conn.execute(
-            """
-            SELECT id
-            FROM sessions
-            WHERE owner_telegram_id = ? AND is_active = 1
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (owner_telegram_id,),
-        ).fetchone()
+        await self._require_conn().execute(f"ALTER TABLE messages ADD COLUMN {name} {ddl}")
+
+    async def get_or_create_active_session(self, owner_telegram_id: int) -> int:
+        row = await self._fetchone(SQL_GET_ACTIVE_SESSION, (owner_telegram_id,))
         if row:
             return int(row["id"])
-        return self.create_new_session(owner_telegram_id)
-
-    def create_new_session(self, owner_telegram_id: int) -> int:
-        now = _utc_now_iso()
-        with self._conn:
-            self._conn.execute(
-                "UPDATE sessions SET is_active = 0 WHERE owner_telegram_id = ? AND is_active = 1",
-                (owner_telegram_id,),
-            )
-            cursor = self._conn.execute(
-                """
-                INSERT INTO sessions (owner_telegram_id, created_at, is_active)
-                VALUES (?, ?, 1)
-                """,
-                (owner_telegram_id, now),
-            )
-        return int(cursor.lastrowid)
+        await self._write((SQL_INSERT_SESSION_IF_NONE_ACTIVE, (owner_telegram_id, utc_now_iso())))
+        row = await self._fetchone(SQL_GET_ACTIVE_SESSION, (owner_telegram_id,))
+        if not row:
+            raise RuntimeError(f"No active session for owner {owner_telegram_id}")
+        return int(row["id"])
 
-    def add_message(
+    async def create_new_session(self, owner_telegram_id: int) -> int:
+        # An upsert cannot both retire the old active row and insert a new one, so this
+        # stays two statements; they run as one atomic write op.
+        now = utc_now_iso()
+        return await self._write(
+            (SQL_DEACTIVATE_SESSIONS, (owner_telegram_id,)),
+            (SQL_INSERT_SESSION, (owner_telegram_id, now)),
+        )
+
+    async def add_message(
         self,
         session_id: int,
         role: str,
         content: str,
         meta: dict[str, Any] | None = None,
         is_proactive: bool = False,
+        now: str | None = None,
     ) -> int:
-        meta_json = json.dumps(meta, ensure_ascii=True) if meta else None
-        cursor = self._conn.execute(
-            """
-            INSERT INTO messages (session_id, role, content, created_at, meta_json, is_proactive)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (session_id, role, content, _utc_now_iso(), meta_json, int(is_proactive)),
-        )
-        self._conn.commit()
-        return int(cursor.lastrowid)
-
-    def get_context_messages(self, session_id: int, limit: int) -> list[ChatMessage]:
-        rows = self._conn.execute(
-            """
-            SELECT role, content
-            FROM messages
-            WHERE session_id = ? AND role IN ('user', 'assistant')
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (session_id, limit),
-        ).fetchall()
-        rows = list(reversed(rows))
-        return [ChatMessage(role=row["role"], content=row["content"]) for row in rows]
-
-    def get_last_user_message(self, session_id: int) -> LastUserMessage | None:
-        row = self._conn.execute(
-            """
-            SELECT id, content, created_at
-            FROM messages
-            WHERE session_id = ? AND role = 'user'
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (session_id,),
-        ).fetchone()
+        """Insert a message; `now` lets a handler stamp several rows with one timestamp."""
+        meta_json = orjson.dumps(meta).decode() if meta else None
+        return await self._write(
+            (
+                SQL_INSERT_MESSAGE,
+                (
+                    session_id,
+                    ROLE_TO_INT[role],
+                    content,
+                    now or utc_now_iso(),
+                    meta_json,
+                    int(is_proactive),
+                ),
+            )
+        )
+
+    async def iter_messages_desc(self, session_id: int) -> AsyncIterator[ChatMessage]:
+        async with self._require_conn().execute(SQL_ITER_MESSAGES_DESC, (session_id,)) as cursor:
+            while rows := await cursor.fetchmany(ITER_PAGE_SIZE):
+                for row in rows:
+                    yield _chat_message(row)
+
+    async def get_messages_between(
+        self,
+        session_id: int,
+        after_id: int,
+        before_id: int,
+        limit: int = -1,
+    ) -> list[ChatMessage]:
+        """Oldest first; a negative `limit` means no limit."""
+        rows = await self._fetchall(
+            SQL_GET_MESSAGES_BETWEEN,
+            (session_id, after_id, before_id, limit),
+        )
+        return [_chat_message(row) for row in rows]
+
+    async def count_messages_between(self, session_id: int, after_id: int, before_id: int) -> int:
+        row = await self._fetchone(SQL_COUNT_MESSAGES_BETWEEN, (session_id, after_id, before_id))
+        return int(row["c"]) if row else 0
+
+    async def get_latest_summary(self, session_id: int) -> Summary | None:
+        row = await self._fetchone(SQL_GET_LATEST_SUMMARY, (session_id,))
+        if not row:
+            return None
+        return Summary(upto_message_id=int(row["upto_message_id"]), content=str(row["content"]))
+
+    async def add_summary(self, session_id: int, upto_message_id: int, content: str) -> int:
+        return await self._write(
+            (SQL_INSERT_SUMMARY, (session_id, upto_message_id, content, utc_now_iso()))
+        )
+
+    async def add_message_embedding(
+        self,
+        message_id: int,
+        session_id: int,
+        vector: list[float],
+    ) -> None:
+        await self._write(
+            (SQL_UPSERT_EMBEDDING, (message_id, session_id, _serialize_vector(vector)))
+        )
+
+    async def add_message_embeddings(self, items: list[tuple[int, int, list[float]]]) -> None:
+        """Bulk insert of (message_id, session_id, vector) rows."""
+        rows = [
+            (message_id, session_id, _serialize_vector(vector))
+            for message_id, session_id, vector in items
+        ]
+        if rows:
+            await self._write((SQL_UPSERT_EMBEDDING, rows))
+
+    async def get_unindexed_messages(
+        self,
+        limit: int,
+        before_id: int = MAX_ROWID,
+    ) -> list[tuple[int, int, str]]:
+        """(id, session_id, content) of messages without embeddings, newest first."""
+        rows = await self._fetchall(SQL_GET_UNINDEXED_MESSAGES, (before_id, limit))
+        return [(int(row["id"]), int(row["session_id"]), str(row["content"])) for row in rows]
+
+    async def search_similar_messages(
+        self,
+        session_id: int,
+        vector: list[float],
+        before_id: int,
+        limit: int,
+    ) -> list[ChatMessage]:
+        rows = await self._fetchall(
+            SQL_SEARCH_SIMILAR,
+            (session_id, before_id, _serialize_vector(vector), limit),
+        )
+        return sorted((_chat_message(row) for row in rows), key=lambda m: m.id)
+
+    async def get_last_user_message(self, session_id: int) -> LastUserMessage | None:
+        row = await self._fetchone(SQL_GET_LAST_USER_MESSAGE, (session_id,))
         if not row:
             return None
         return LastUserMessage(
@@ -151,59 +549,220 @@ class Database:
             created_at=datetime.fromisoformat(str(row["created_at"])),
         )
 
-    def has_proactive_after(self, session_id: int, message_id: int) -> bool:
-        row = self._conn.execute(
-            """
-            SELECT id
-            FROM messages
-            WHERE session_id = ? AND role = 'assistant' AND is_proactive = 1 AND id > ?
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (session_id, message_id),
-        ).fetchone()
-        return row is not None
-
-    def export_recent_messages(self, session_id: int, limit: int) -> list[dict[str, str]]:
-        rows = self._conn.execute(
-            """
-            SELECT role, content, created_at
-            FROM messages
-            WHERE session_id = ?
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (session_id, limit),
-        ).fetchall()
+    async def get_last_proactive_id(self, session_id: int) -> int | None:
+        row = await self._fetchone(SQL_GET_LAST_PROACTIVE_ID, (session_id,))
+        return int(row["id"]) if row and row["id"] is not None else None
+
+    async def export_recent_messages(self, session_id: int, limit: int) -> list[dict[str, str]]:
+        rows = await self._fetchall(SQL_EXPORT_RECENT, (session_id, limit))
         rows = list(reversed(rows))
         return [
             {
-                "role": str(row["role"]),
+                "role": INT_TO_ROLE[row["role"]],
                 "content": str(row["content"]),
                 "created_at": str(row["created_at"]),
             }
             for row in rows
         ]
 
-    def health(self, owner_telegram_id: int) -> dict[str, Any]:
-        active = self._conn.execute(
-            """
-            SELECT id, created_at
-            FROM sessions
-            WHERE owner_telegram_id = ? AND is_active = 1
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (owner_telegram_id,),
-        ).fetchone()
-        total_messages = self._conn.execute("SELECT COUNT(*) AS c FROM messages").fetchone()["c"]
+    async def get_cached_response(self, key: str, not_before: str) -> tuple[str, str] | None:
+        """Returns (payload, created_at) of a row not older than `not_before`."""
+        row = await self._fetchone(SQL_GET_CACHED_RESPONSE, (key, not_before))
+        return (str(row["payload"]), str(row["created_at"])) if row else None
+
+    async def put_cached_response(
+        self,
+        key: str,
+        payload: str,
+        not_before: str,
+        max_rows: int,
+    ) -> None:
+        """Store a reply and drop rows older than `not_before` or beyond `max_rows`."""
+        await self._write(
+            (SQL_PUT_CACHED_RESPONSE, (key, payload, utc_now_iso())),
+            (SQL_PRUNE_RESPONSE_CACHE, (not_before, max_rows)),
+        )
+
+    async def health(self, owner_telegram_id: int) -> dict[str, Any]:
+        active = await self._fetchone(SQL_GET_ACTIVE_SESSION, (owner_telegram_id,))
+        total = await self._fetchone(SQL_COUNT_MESSAGES)
         return {
             "db": "ok",
             "active_session_id": int(active["id"]) if active else None,
             "active_session_created_at": str(active["created_at"]) if active else None,
-            "total_messages": int(total_messages),
+            "total_messages": int(total["c"]) if total else 0,
         }
 
+    def _require_conn(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            raise RuntimeError("Database is not initialized, call init() first")
+        return self._conn
+
+    async def _fetchone(self, sql: str, params: Params = ()) -> sqlite3.Row | None:
+        async with self._require_conn().execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    async def _fetchall(self, sql: str, params: Params = ()) -> list[sqlite3.Row]:
+        async with self._require_conn().execute(sql, params) as cursor:
+            return list(await cursor.fetchall())
+
+    async def flush(self) -> None:
+        """Wait until every write queued so far is committed."""
+        await self._write()
+
+    async def _write(self, *statements: Statement) -> int:
+        """Queue statements as one atomic unit; returns the id of the last one.
+
+        The id is the first column of its RETURNING row if any, else lastrowid.
+        Resolves once the batch holding the statements is committed, at the latest
+        after FLUSH_INTERVAL_SECONDS. With no statements it just waits for that commit.
+        """
+        if self._writer_task is None or self._writer_task.done():
+            raise RuntimeError("Database writer is not running")
+        future: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+        await self._write_queue.put(_WriteOp(list(statements), future))
+        return await future
+
+    async def _writer(self) -> None:
+        conn = self._require_conn()
+        loop = asyncio.get_running_loop()
+        deadline: float | None = None
+        # Futures of executed but not yet committed ops, with the ids they resolve to.
+        pending: list[tuple[asyncio.Future[int], int]] = []
+        op: _WriteOp | None = None
+        try:
+            while True:
+                if deadline is None:
+                    op = await self._write_queue.get()
+                else:
+                    try:
+                        op = await asyncio.wait_for(
+                            self._write_queue.get(),
+                            timeout=max(0.0, deadline - loop.time()),
+                        )
+                    except TimeoutError:
+                        await self._commit(conn, pending)
+                        deadline = None
+                        continue
+
+                if op is None or not op.statements:
+                    if op is not None:
+                        pending.append((op.future, 0))
+                    await self._commit(conn, pending)
+                    deadline = None
+                    if op is None:
+                        return
+                    continue
+
+                lastrowid = await self._apply(conn, op)
+                if lastrowid is not None:
+                    pending.append((op.future, lastrowid))
+                if self._write_queue.empty():
+                    # Group commit: whatever queued up meanwhile shares this commit.
+                    await self._commit(conn, pending)
+                    deadline = None
+                elif deadline is None and conn.in_transaction:
+                    deadline = loop.time() + FLUSH_INTERVAL_SECONDS
+        except BaseException:
+            logger.exception("SQLite writer stopped")
+            raise
+        finally:
+            # Nobody is left to commit: fail whatever is still waiting so callers
+            # do not hang forever.
+            error = RuntimeError("Database writer stopped")
+            _fail_all(pending, error)
+            if op is not None and not op.future.done():
+                op.future.set_exception(error)
+            while not self._write_queue.empty():
+                queued = self._write_queue.get_nowait()
+                if queued is not None and not queued.future.done():
+                    queued.future.set_exception(error)
+
+    @staticmethod
+    async def _commit(
+        conn: aiosqlite.Connection,
+        pending: list[tuple[asyncio.Future[int], int]],
+    ) -> None:
+        """Commit and settle the batch: results on success, the error on failure."""
+        try:
+            await conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("SQLite commit failed")
+            await conn.rollback()
+            _fail_all(pending, exc)
+            return
+        for future, lastrowid in pending:
+            if not future.done():
+                future.set_result(lastrowid)
+        pending.clear()
+
+    @staticmethod
+    async def _apply(conn: aiosqlite.Connection, op: _WriteOp) -> int | None:
+        """Execute one op inside a savepoint; returns its id, or None if it failed."""
+        if not conn.in_transaction:
+            await conn.execute("BEGIN")
+        await conn.execute("SAVEPOINT write_op")
+        lastrowid = 0
+        try:
+            for sql, params in op.statements:
+                if isinstance(params, list):
+                    cursor = await conn.executemany(sql, params)
+                else:
+                    cursor = await conn.execute(sql, params)
+                row = await cursor.fetchone() if cursor.description else None
+                lastrowid = int(row[0]) if row else int(cursor.lastrowid or 0)
+                await cursor.close()
+            await conn.execute("RELEASE write_op")
+        except Exception as exc:  # noqa: BLE001
+            # Undo only this operation, the rest of the pending batch stays intact.
+            await conn.execute("ROLLBACK TO write_op")
+            await conn.execute("RELEASE write_op")
+            logger.exception("SQLite write failed")
+            if not op.future.done():
+                op.future.set_exception(exc)
+            return None
+        return lastrowid
+
+
+def _fail_all(pending: list[tuple[asyncio.Future[int], int]], error: BaseException) -> None:
+    for future, _ in pending:
+        if not future.done():
+            future.set_exception(error)
+    pending.clear()
+
+
+def check_vector_search() -> str:
+    """Verify sqlite-vec can be loaded by this sqlite3 build; returns the extension path."""
+    try:
+        import sqlite_vec
+    except ImportError as exc:
+        raise EmbeddingError("sqlite-vec is not installed: pip install sqlite-vec") from exc
+    if not hasattr(sqlite3.Connection, "enable_load_extension"):
+        raise EmbeddingError("This Python sqlite3 build cannot load extensions")
+
+    extension_path = sqlite_vec.loadable_path()
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.enable_load_extension(True)
+        conn.load_extension(extension_path)
+    except sqlite3.Error as exc:
+        raise EmbeddingError(f"Unable to load sqlite-vec: {exc}") from exc
+    finally:
+        conn.close()
+    return extension_path
+
+
+def _chat_message(row: sqlite3.Row) -> ChatMessage:
+    return ChatMessage(
+        id=int(row["id"]),
+        role=INT_TO_ROLE[row["role"]],
+        content=str(row["content"]),
+    )
+
+
+def _serialize_vector(vector: list[float]) -> bytes:
+    return struct.pack(f"{len(vector)}f", *vector)
+
 
-def _utc_now_iso() -> str:
+def utc_now_iso() -> str:
     return datetime.now(tz=timezone.utc).isoformat()
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class EmbeddingError(RuntimeError):
+    pass
+
+
+class Embedder:
+    """Local ONNX text embeddings via fastembed (optional dependency)."""
+
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL) -> None:
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as exc:
+            raise EmbeddingError(
+                "RETRIEVAL_ENABLED requires the optional packages: pip install fastembed sqlite-vec"
+            ) from exc
+        self._model: Any = TextEmbedding(model_name=model)
+        self._embed_cached = functools.lru_cache(maxsize=128)(self._embed_sync)
+
+    async def embed(self, text: str) -> list[float]:
+        return list(await asyncio.to_thread(self._embed_cached, text))
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        return await asyncio.to_thread(self._embed_many_sync, texts)
+
+    def _embed_many_sync(self, texts: list[str]) -> list[list[float]]:
+        return [[float(x) for x in vector] for vector in self._model.embed(texts)]
+
+    def _embed_sync(self, text: str) -> tuple[float, ...]:
+        vector = next(iter(self._model.embed([text])))
+        return tuple(float(x) for x in vector)
@@ -1,14 +1,26 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
 import time
-from typing import Any
+from typing import Any, AsyncGenerator, AsyncIterator
 
+import httpx
+import tiktoken
 from openai import APIConnectionError, APIStatusError, AsyncOpenAI, RateLimitError
 
+from response_cache import ResponseCache
+
 logger = logging.getLogger(__name__)
 
+CACHE_CONTROL: dict[str, str] = {"type": "ephemeral"}
+MAX_REPLY_TOKENS = 350
+TOKENS_PER_MESSAGE = 4
+FALLBACK_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN_ESTIMATE = 2
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
 
 class LLMError(RuntimeError):
     pass
@@ -22,26 +34,126 @@ class PolzaLLMClient:
         model: str,
         timeout_seconds: float,
         max_retries: int = 2,
+        prompt_cache_enabled: bool = True,
+        response_cache: ResponseCache | None = None,
+        context_token_budget: int | None = None,
     ) -> None:
-        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self._http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(timeout_seconds),
+            limits=httpx.Limits(
+                max_connections=64,
+                max_keepalive_connections=32,
+                keepalive_expiry=300,
+            ),
+        )
+        self._client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self._http_client,
+        )
         self._model = model
         self._timeout_seconds = timeout_seconds
         self._max_retries = max_retries
+        self._prompt_cache_enabled = prompt_cache_enabled
+        self._response_cache = response_cache
+        self._prompt_token_limit = (
+            context_token_budget - MAX_REPLY_TOKENS if context_token_budget else None
+        )
+        self._encoding = _load_encoding(model)
+
+    async def aclose(self) -> None:
+        await self._client.close()
+        await self._http_client.aclose()
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN_ESTIMATE)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_message_tokens(self, message: dict[str, Any]) -> int:
+        content = message.get("content")
+        if isinstance(content, list):
+            text = "".join(str(part.get("text", "")) for part in content)
+        else:
+            text = str(content or "")
+        return self.count_tokens(text) + TOKENS_PER_MESSAGE
+
+    def system_message(self, content: str) -> dict[str, Any]:
+        """Build the system block, marked as a cacheable prompt prefix when enabled."""
+        if not self._prompt_cache_enabled:
+            return {"role": "system", "content": content}
+        return {
+            "role": "system",
+            "content": [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}],
+        }
+
+    def trim_to_budget(
+        self,
+        messages: list[dict[str, Any]],
+        max_tokens: int,
+    ) -> list[dict[str, Any]]:
+        """Drop the oldest non-system messages until the prompt fits into `max_tokens`.
+
+        System messages and the last message are always kept. Returns a new list when
+        anything was dropped and raises LLMError when even that does not fit, sparing
+        a round trip the provider would reject.
+        """
+        costs = [self.count_message_tokens(message) for message in messages]
+        total = sum(costs)
+        if total <= max_tokens:
+            return messages
 
-    async def generate(self, messages: list[dict[str, str]]) -> tuple[str, dict[str, Any]]:
+        dropped: set[int] = set()
+        for index, message in enumerate(messages[:-1]):
+            if total <= max_tokens:
+                break
+            if message.get("role") == "system":
+                continue
+            dropped.add(index)
+            total -= costs[index]
+        if total > max_tokens:
+            raise LLMError(f"Prompt needs ~{total} tokens, the limit is {max_tokens}")
+        logger.warning(
+            "Prompt exceeds %d tokens, dropped %d oldest messages (now ~%d)",
+            max_tokens,
+            len(dropped),
+            total,
+        )
+        return [message for index, message in enumerate(messages) if index not in dropped]
+
+    @staticmethod
+    def prefix_id(session_id: int, system_prompt: str) -> str:
+        digest = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+        return f"s{session_id}-{digest}"
+
+    async def generate(
+        self,
+        messages: list[dict[str, Any]],
+        prefix_id: str | None = None,
+        prompt_tokens: int | None = None,
+    ) -> tuple[str, dict[str, Any]]:
+        messages = self._fit_prompt(messages, prompt_tokens)
+        cached = await self._cache_get(messages)
+        if cached is not None:
+            logger.info("LLM response served from cache prefix_id=%s", prefix_id)
+            return cached
+
+        self._log_request(messages)
         attempt = 0
         last_exc: Exception | None = None
+        extra_body = {"cache_control": CACHE_CONTROL} if self._prompt_cache_enabled else None
 
         while attempt <= self._max_retries:
             attempt += 1
             started = time.perf_counter()
             try:
-                print(messages)
                 response = await self._client.chat.completions.create(
                     model=self._model,
                     messages=messages,
                     timeout=self._timeout_seconds,
-                    max_tokens=350
+                    max_tokens=MAX_REPLY_TOKENS,
+                    extra_body=extra_body,
                 )
                 latency_ms = int((time.perf_counter() - started) * 1000)
 
@@ -50,27 +162,224 @@ class PolzaLLMClient:
                     raise LLMError("Empty response from LLM")
 
                 usage = response.usage.model_dump() if response.usage else None
+                logger.info(
+                    "LLM response prefix_id=%s latency_ms=%s cached_tokens=%s",
+                    prefix_id,
+                    latency_ms,
+                    _cached_tokens(usage),
+                )
                 meta = {
                     "model": response.model,
                     "latency_ms": latency_ms,
                     "token_usage": usage,
                     "request_id": getattr(response, "id", None),
+                    "prefix_id": prefix_id,
                 }
-                return content, meta
-            except (APIConnectionError, RateLimitError) as exc:
+            except Exception as exc:  # noqa: BLE001
                 last_exc = exc
-                if attempt > self._max_retries:
+                if not self._should_retry(exc, attempt):
                     break
                 await asyncio.sleep(2 ** (attempt - 1))
-            except APIStatusError as exc:
+            else:
+                await self._cache_put(messages, content, meta)
+                return content, meta
+
+        logger.exception("LLM request failed")
+        raise LLMError("LLM request failed") from last_exc
+
+    def generate_stream(
+        self,
+        messages: list[dict[str, Any]],
+        prefix_id: str | None = None,
+        prompt_tokens: int | None = None,
+    ) -> LLMStream:
+        return LLMStream(self, messages, prefix_id, prompt_tokens)
+
+    async def _stream(self, result: LLMStream) -> AsyncGenerator[str, None]:
+        result.messages = self._fit_prompt(result.messages, result.prompt_tokens)
+        messages, prefix_id = result.messages, result.prefix_id
+        cached = await self._cache_get(messages)
+        if cached is not None:
+            logger.info("LLM response served from cache prefix_id=%s", prefix_id)
+            result.text, result.meta = cached
+            yield result.text
+            return
+
+        self._log_request(messages)
+        attempt = 0
+        last_exc: Exception | None = None
+        extra_body = {"cache_control": CACHE_CONTROL} if self._prompt_cache_enabled else None
+
+        while attempt <= self._max_retries:
+            attempt += 1
+            started = time.perf_counter()
+            first_token_ms: int | None = None
+            parts: list[str] = []
+            usage: dict[str, Any] | None = None
+            model: str | None = None
+            request_id: str | None = None
+            try:
+                stream = await self._client.chat.completions.create(
+                    model=self._model,
+                    messages=messages,
+                    timeout=self._timeout_seconds,
+                    max_tokens=MAX_REPLY_TOKENS,
+                    extra_body=extra_body,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                # Closing the stream releases the HTTP response right away, also when
+                # the consumer stops early or the task is cancelled mid-reply.
+                async with stream:
+                    async for chunk in stream:
+                        model = chunk.model or model
+                        request_id = chunk.id or request_id
+                        if chunk.usage:
+                            usage = chunk.usage.model_dump()
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta:
+                            continue
+                        if first_token_ms is None:
+                            first_token_ms = int((time.perf_counter() - started) * 1000)
+                        parts.append(delta)
+                        yield delta
+                latency_ms = int((time.perf_counter() - started) * 1000)
+
+                content = "".join(parts).strip()
+                if not content:
+                    raise LLMError("Empty response from LLM")
+
+                logger.info(
+                    "LLM stream prefix_id=%s ttft_ms=%s latency_ms=%s cached_tokens=%s",
+                    prefix_id,
+                    first_token_ms,
+                    latency_ms,
+                    _cached_tokens(usage),
+                )
+                result.text = content
+                result.meta = {
+                    "model": model,
+                    "latency_ms": latency_ms,
+                    "first_token_ms": first_token_ms,
+                    "token_usage": usage,
+                    "request_id": request_id,
+                    "prefix_id": prefix_id,
+                }
+            except Exception as exc:  # noqa: BLE001
                 last_exc = exc
-                retryable = exc.status_code in {429, 500, 502, 503, 504}
-                if not retryable or attempt > self._max_retries:
+                # Text already shown to the user cannot be taken back, so only retry
+                # failures that happen before the first token.
+                if parts or not self._should_retry(exc, attempt):
                     break
                 await asyncio.sleep(2 ** (attempt - 1))
-            except Exception as exc:  # noqa: BLE001
-                last_exc = exc
-                break
+            else:
+                await self._cache_put(messages, content, result.meta)
+                return
 
-        logger.exception("LLM request failed")
+        logger.error("LLM stream failed", exc_info=last_exc)
         raise LLMError("LLM request failed") from last_exc
+
+    async def _cache_get(
+        self,
+        messages: list[dict[str, Any]],
+    ) -> tuple[str, dict[str, Any]] | None:
+        if not self._response_cache:
+            return None
+        try:
+            return await self._response_cache.get(self._model, messages)
+        except Exception:  # noqa: BLE001
+            logger.warning("Response cache lookup failed", exc_info=True)
+            return None
+
+    async def _cache_put(
+        self,
+        messages: list[dict[str, Any]],
+        content: str,
+        meta: dict[str, Any],
+    ) -> None:
+        # The cache is optional: a failed write must not cost an already paid reply.
+        if not self._response_cache:
+            return
+        try:
+            await self._response_cache.put(self._model, messages, content, meta)
+        except Exception:  # noqa: BLE001
+            logger.warning("Response cache write failed", exc_info=True)
+
+    def _fit_prompt(
+        self,
+        messages: list[dict[str, Any]],
+        prompt_tokens: int | None,
+    ) -> list[dict[str, Any]]:
+        """Trim to the context budget, trusting `prompt_tokens` when the caller counted."""
+        limit = self._prompt_token_limit
+        if not limit or (prompt_tokens is not None and prompt_tokens <= limit):
+            return messages
+        return self.trim_to_budget(messages, limit)
+
+    def _log_request(self, messages: list[dict[str, Any]]) -> None:
+        # Token counting is not free, so skip it entirely unless debug logging is on.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "LLM request messages=%d tokens~%d",
+                len(messages),
+                sum(self.count_message_tokens(message) for message in messages),
+            )
+
+    def _should_retry(self, exc: Exception, attempt: int) -> bool:
+        if attempt > self._max_retries:
+            return False
+        if isinstance(exc, (APIConnectionError, RateLimitError)):
+            return True
+        if isinstance(exc, APIStatusError):
+            return exc.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+
+class LLMStream:
+    """Async iterator over reply text deltas.
+
+    `text` and `meta` hold the full stripped reply and its metadata once iteration
+    finishes without error. Iterate it once, under `contextlib.aclosing`, so an
+    abandoned stream is closed deterministically.
+    """
+
+    def __init__(
+        self,
+        client: PolzaLLMClient,
+        messages: list[dict[str, Any]],
+        prefix_id: str | None,
+        prompt_tokens: int | None = None,
+    ) -> None:
+        self._client = client
+        self.messages = messages
+        self.prefix_id = prefix_id
+        self.prompt_tokens = prompt_tokens
+        self.text = ""
+        self.meta: dict[str, Any] = {}
+        self._chunks: AsyncGenerator[str, None] | None = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        if self._chunks is None:
+            self._chunks = self._client._stream(self)
+        return self._chunks
+
+    async def aclose(self) -> None:
+        if self._chunks is not None:
+            await self._chunks.aclose()
+
+
+def _cached_tokens(usage: dict[str, Any] | None) -> int | None:
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens")
+
+
+def _load_encoding(model: str) -> Any | None:
+    name = model.rsplit("/", 1)[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("tiktoken encoding is unavailable (%s), estimating tokens by length", exc)
+        return None
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import orjson
+
+from db import Database
+from embeddings import Embedder
+
+logger = logging.getLogger(__name__)
+
+CachedResponse = tuple[str, dict[str, Any]]
+# A cached reply with the time.monotonic() moment it stops being served.
+_Entry = tuple[float, CachedResponse]
+
+
+class ResponseCache:
+    """Exact (memory LRU + SQLite) and optional semantic cache for LLM replies.
+
+    The exact tier is keyed by a SHA-256 of the canonicalized request. The semantic
+    tier reuses a reply when the history before the last user turn is identical and
+    the last user turn is close enough by cosine similarity. Entries expire after
+    `ttl_seconds`; the SQLite table is pruned to that age and to `max_rows` on write.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_entries: int = 256,
+        embedder: Embedder | None = None,
+        similarity_threshold: float = 0.97,
+        ttl_seconds: float = 24 * 3600,
+        max_rows: int = 1000,
+        max_per_history: int = 8,
+    ) -> None:
+        self._db = db
+        self._max_entries = max_entries
+        self._embedder = embedder
+        self._similarity_threshold = similarity_threshold
+        self._ttl_seconds = ttl_seconds
+        self._max_rows = max_rows
+        self._max_per_history = max_per_history
+        self._exact: OrderedDict[str, _Entry] = OrderedDict()
+        self._semantic: OrderedDict[str, list[tuple[list[float], _Entry]]] = OrderedDict()
+
+    async def get(self, model: str, messages: list[dict[str, Any]]) -> CachedResponse | None:
+        key = _request_key(model, messages)
+        cached = self._exact.get(key)
+        if cached is None or cached[0] <= time.monotonic():
+            cached = await self._load(key)
+            if cached is not None:
+                self._remember(key, cached)
+        else:
+            # A hit only refreshes the LRU position, never the expiry.
+            self._exact.move_to_end(key)
+        if cached is not None:
+            hit = cached[1]
+            return hit[0], {**hit[1], "cache": "exact"}
+
+        semantic = await self._semantic_lookup(model, messages)
+        if semantic is not None:
+            return semantic[0], {**semantic[1], "cache": "semantic"}
+        return None
+
+    async def put(
+        self,
+        model: str,
+        messages: list[dict[str, Any]],
+        content: str,
+        meta: dict[str, Any],
+    ) -> None:
+        key = _request_key(model, messages)
+        entry = (content, meta)
+        self._remember(key, (time.monotonic() + self._ttl_seconds, entry))
+        await self._db.put_cached_response(
+            key,
+            orjson.dumps({"content": content, "meta": meta}).decode(),
+            not_before=self._not_before(),
+            max_rows=self._max_rows,
+        )
+
+        vector = await self._last_user_vector(messages)
+        if vector is None:
+            return
+        history_key = _request_key(model, messages[:-1])
+        bucket = self._semantic.setdefault(history_key, [])
+        bucket.append((vector, (time.monotonic() + self._ttl_seconds, entry)))
+        del bucket[: -self._max_per_history]
+        self._semantic.move_to_end(history_key)
+        while len(self._semantic) > self._max_entries:
+            self._semantic.popitem(last=False)
+
+    def _not_before(self) -> str:
+        cutoff = datetime.now(tz=timezone.utc) - timedelta(seconds=self._ttl_seconds)
+        return cutoff.isoformat()
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        self._exact[key] = entry
+        self._exact.move_to_end(key)
+        while len(self._exact) > self._max_entries:
+            self._exact.popitem(last=False)
+
+    async def _load(self, key: str) -> _Entry | None:
+        row = await self._db.get_cached_response(key, not_before=self._not_before())
+        if row is None:
+            return None
+        payload, created_at = row
+        try:
+            data = orjson.loads(payload)
+            age = datetime.now(tz=timezone.utc) - datetime.fromisoformat(created_at)
+            expires_at = time.monotonic() + self._ttl_seconds - age.total_seconds()
+            return expires_at, (str(data["content"]), dict(data.get("meta") or {}))
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed response cache entry %s", key)
+            return None
+
+    async def _semantic_lookup(
+        self,
+        model: str,
+        messages: list[dict[str, Any]],
+    ) -> CachedResponse | None:
+        history_key = _request_key(model, messages[:-1])
+        bucket = self._semantic.get(history_key)
+        if not bucket:
+            return None
+        now = time.monotonic()
+        bucket[:] = [item for item in bucket if item[1][0] > now]
+        if not bucket:
+            del self._semantic[history_key]
+            return None
+        vector = await self._last_user_vector(messages)
+        if vector is None:
+            return None
+
+        best: CachedResponse | None = None
+        best_score = self._similarity_threshold
+        for candidate, (_, entry) in bucket:
+            score = _cosine(vector, candidate)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    async def _last_user_vector(self, messages: list[dict[str, Any]]) -> list[float] | None:
+        if not self._embedder or not messages:
+            return None
+        last = messages[-1]
+        if last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        try:
+            return await self._embedder.embed(last["content"])
+        except Exception:  # noqa: BLE001
+            logger.debug("Unable to embed message for semantic cache", exc_info=True)
+            return None
+
+
+def _request_key(model: str, messages: list[dict[str, Any]]) -> str:
+    canonical = orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0